@@ -46,18 +46,29 @@ try:
     print("\n✅ All models downloaded successfully!")
     print("\n📊 Cached files:")
 
-    # List cached files
-    total_size = 0
-    for root, dirs, files in os.walk(cache_dir):
-        level = root.replace(str(cache_dir), '').count(os.sep)
+    # List cached files (scandir entries carry their stat info, no extra lookups)
+    def walk_cache(path, level=0):
+        """Print a directory tree and return its total size in MB"""
         indent = ' ' * 2 * level
-        print(f"{indent}{os.path.basename(root)}/")
+        print(f"{indent}{os.path.basename(path)}/")
         subindent = ' ' * 2 * (level + 1)
-        for file in files:
-            file_path = Path(root) / file
-            size_mb = file_path.stat().st_size / (1024 * 1024)
-            total_size += size_mb
-            print(f"{subindent}{file} ({size_mb:.1f} MB)")
+
+        size = 0.0
+        subdirs = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                else:
+                    size_mb = entry.stat().st_size / (1024 * 1024)
+                    size += size_mb
+                    print(f"{subindent}{entry.name} ({size_mb:.1f} MB)")
+
+        for subdir in subdirs:
+            size += walk_cache(subdir, level + 1)
+        return size
+
+    total_size = walk_cache(str(cache_dir))
 
     print(f"\n📦 Total cache size: {total_size:.1f} MB")
     print("✅ Model caching complete!")
@@ -0,0 +1,344 @@
+"""
+Batched OCR pipeline shared by the FastAPI server (main.py) and the RunPod
+handler (handler.py): deferred line recognition, inference contexts, pinned
+host-to-device uploads and model compilation on top of Mokuro's page OCR
+"""
+import logging
+import re
+import threading
+from contextlib import contextmanager
+from typing import List, Dict, Any
+
+import numpy as np
+import torch
+from PIL import Image
+
+try:
+    from manga_ocr.ocr import post_process
+except ImportError:
+    post_process = None
+
+logger = logging.getLogger(__name__)
+
+OCR_MAX_LENGTH = 300  # Max tokens generated per text line
+
+# Set by enable_cuda() once the models are on the GPU
+inference_dtype = None  # Half-precision autocast dtype (None = FP32)
+transfer_stream = None  # CUDA stream for host-to-device copies
+
+
+def enable_cuda(dtype=None) -> None:
+    """
+    Switch the pipeline to CUDA: autocast to dtype during inference and
+    upload recognizer batches on a side stream.
+
+    Args:
+        dtype: torch.bfloat16 / torch.float16, or None to stay in FP32
+    """
+    global inference_dtype, transfer_stream
+    inference_dtype = dtype
+    if transfer_stream is None:
+        transfer_stream = torch.cuda.Stream()
+
+
+def get_page_ocr(generator):
+    """Return Mokuro's page OCR pipeline (text detector + recognizer)"""
+    # Mokuro 0.2.x keeps it on `mpocr`
+    return getattr(generator, 'mpocr', None) or getattr(generator, '_manga_page_ocr', None)
+
+
+def patch_imread() -> None:
+    """
+    Let MangaPageOcr take decoded arrays instead of file paths (it normally
+    re-reads every page from disk via imread).
+    """
+    try:
+        from mokuro import manga_page_ocr as manga_page_ocr_module
+
+        original_imread = manga_page_ocr_module.imread
+    except (ImportError, AttributeError):
+        return
+
+    def imread_array_or_path(path, *args, **kwargs):
+        if isinstance(path, np.ndarray):
+            return path
+        return original_imread(path, *args, **kwargs)
+
+    manga_page_ocr_module.imread = imread_array_or_path
+
+
+@contextmanager
+def inference_context(autocast: bool = True):
+    """
+    No autograd, plus half-precision autocast when enable_cuda() set a dtype.
+
+    Args:
+        autocast: False for the text detector: its network autocasts itself
+            (see autocast_detector), and its postprocessing runs in FP32
+    """
+    with torch.inference_mode():
+        if autocast and inference_dtype is not None:
+            with torch.autocast(device_type='cuda', dtype=inference_dtype):
+                yield
+        else:
+            yield
+
+
+class FloatOutputs(torch.nn.Module):
+    """
+    Runs a network under half-precision autocast and returns its floating
+    point outputs as FP32, for callers that .numpy() them (numpy has no
+    bfloat16).
+    """
+
+    def __init__(self, model, dtype):
+        super().__init__()
+        self.model = model
+        self.dtype = dtype
+
+    def forward(self, *args, **kwargs):
+        with torch.autocast(device_type='cuda', dtype=self.dtype):
+            outputs = self.model(*args, **kwargs)
+        return self._to_float(outputs)
+
+    @classmethod
+    def _to_float(cls, outputs):
+        if isinstance(outputs, torch.Tensor):
+            return outputs.float() if outputs.is_floating_point() else outputs
+        if isinstance(outputs, (list, tuple)):
+            return type(outputs)(cls._to_float(output) for output in outputs)
+        return outputs
+
+
+def autocast_detector(mpo) -> None:
+    """
+    Run the text detector's network in inference_dtype (set by enable_cuda).
+
+    The convolutions run under autocast; comic_text_detector's
+    postprocessing calls .numpy() on the outputs, so they are cast back to
+    FP32 on the way out. Call before compile_models so the autocast region
+    is compiled with the network.
+
+    Args:
+        mpo: Mokuro page OCR pipeline
+    """
+    detector = getattr(mpo, 'text_detector', None)
+    if inference_dtype is None or detector is None:
+        return
+
+    for attr in ('model', 'net'):
+        model = getattr(detector, attr, None)
+        if isinstance(model, torch.nn.Module) and not isinstance(model, FloatOutputs):
+            setattr(detector, attr, FloatOutputs(model, inference_dtype))
+            logger.info(f"✅ Text detector runs in {inference_dtype}")
+            break
+
+
+class LineCollector:
+    """
+    Wraps MangaPageOcr.mocr so text line recognition can be deferred.
+
+    Called normally it just runs the recognizer. During detect(), each line
+    crop is recorded instead and a placeholder token returned; fill() swaps
+    the tokens for batched recognizer output afterwards. Collection is per
+    thread, so other callers of the page OCR are unaffected.
+    """
+
+    PLACEHOLDER = re.compile('\ue000(\\d+)\ue001')
+
+    def __init__(self, recognizer):
+        self.recognizer = recognizer
+        self._local = threading.local()
+
+    def __getattr__(self, name):
+        # Expose the wrapped recognizer's attributes (model, tokenizer, ...)
+        return getattr(self.recognizer, name)
+
+    def __call__(self, img):
+        crops = getattr(self._local, 'crops', None)
+        if crops is None:
+            return self.recognizer(img)
+        crops.append(img)
+        return f"\ue000{len(crops) - 1}\ue001"
+
+    def detect(self, mpo, img):
+        """
+        Run page OCR (on a path or decoded array) with recognition deferred.
+
+        Returns:
+            (page result, line crops)
+        """
+        self._local.crops = []
+        try:
+            with inference_context(autocast=False):
+                return mpo(img), self._local.crops
+        finally:
+            self._local.crops = None
+
+    @classmethod
+    def fill(cls, page_result: Dict[str, Any], texts: List[str]) -> Dict[str, Any]:
+        """Replace placeholder tokens in a page result with recognized texts"""
+        for block in page_result.get('blocks', []):
+            if 'lines' in block:
+                block['lines'] = [
+                    cls.PLACEHOLDER.sub(lambda m: texts[int(m.group(1))], line)
+                    for line in block['lines']
+                ]
+        return page_result
+
+
+class PinnedStaging:
+    """
+    Two reusable pinned host buffers for host-to-device batch copies.
+
+    Pinning memory is expensive, so instead of pinning every batch anew,
+    batches are copied into one of two page-locked buffers (allocated once,
+    grown if a batch is larger) and uploaded with non_blocking=True on
+    transfer_stream. The buffers alternate, and each is only refilled once
+    the copy out of it has finished.
+    """
+
+    def __init__(self):
+        self._buffers = [None, None]
+        self._copied = [None, None]  # CUDA events marking each buffer's last copy
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def upload(self, tensor, device, dtype):
+        """Copy tensor to device (cast to dtype) through a pinned buffer"""
+        with self._lock:
+            i = self._next
+            self._next ^= 1
+            if self._copied[i] is not None:
+                self._copied[i].synchronize()
+
+            buffer = self._buffers[i]
+            if buffer is None or buffer.dtype != dtype or buffer.numel() < tensor.numel():
+                buffer = torch.empty(tensor.numel(), dtype=dtype, pin_memory=True)
+                self._buffers[i] = buffer
+
+            staged = buffer[:tensor.numel()].view(tensor.shape)
+            staged.copy_(tensor)
+            with torch.cuda.stream(transfer_stream):
+                uploaded = staged.to(device, non_blocking=True)
+                self._copied[i] = torch.cuda.Event()
+                self._copied[i].record(transfer_stream)
+            return uploaded
+
+
+pinned_staging = PinnedStaging()
+
+
+def upload_batch(model, pixel_values):
+    """
+    Move a preprocessed batch to the recognizer's device.
+
+    On CUDA the batch is cast into a reused pinned buffer and copied with
+    non_blocking=True on transfer_stream, so the transfer overlaps
+    whatever the GPU is still computing.
+    """
+    if transfer_stream is None or model.device.type != 'cuda':
+        return pixel_values.to(model.device, dtype=model.dtype)
+
+    return pinned_staging.upload(pixel_values, model.device, model.dtype)
+
+
+def recognize_lines(recognizer, crops: list, batch_size: int, pool) -> List[str]:
+    """
+    Recognize text line crops in batched forward passes.
+
+    manga-ocr's processor resizes every crop to the same ViT input size, so
+    crops stack into one (N, 3, H, W) tensor and go through model.generate
+    together instead of one call per line. While a batch is being
+    generated, the next one is preprocessed and uploaded on pool.
+
+    Args:
+        recognizer: manga-ocr recognizer (processor, model, tokenizer)
+        crops: Text line crops (PIL images or arrays)
+        batch_size: Max crops per forward pass
+        pool: Executor that prepares the next batch
+
+    Returns:
+        One text per crop, in order
+    """
+    processor = (getattr(recognizer, 'processor', None)
+                 or getattr(recognizer, 'feature_extractor', None))
+    if processor is None or post_process is None:
+        # Unknown recognizer layout: fall back to one call per line
+        return [recognizer(crop) for crop in crops]
+
+    model = recognizer.model
+
+    def prepare(start):
+        images = [
+            (crop if isinstance(crop, Image.Image) else Image.fromarray(crop))
+            .convert('L').convert('RGB')
+            for crop in crops[start:start + batch_size]
+        ]
+        return upload_batch(model, processor(images, return_tensors='pt').pixel_values)
+
+    texts = []
+    next_batch = None
+
+    for start in range(0, len(crops), batch_size):
+        pixel_values = next_batch.result() if next_batch is not None else prepare(start)
+
+        if transfer_stream is not None and pixel_values.is_cuda:
+            # Compute must not start before this batch's copy has landed
+            compute_stream = torch.cuda.current_stream()
+            compute_stream.wait_stream(transfer_stream)
+            pixel_values.record_stream(compute_stream)
+
+        # generate blocks this thread until the batch is done, so the next
+        # batch is prepared on another thread in the meantime
+        next_batch = None
+        if start + batch_size < len(crops):
+            next_batch = pool.submit(prepare, start + batch_size)
+
+        with inference_context():
+            token_ids = model.generate(pixel_values, max_length=OCR_MAX_LENGTH)
+
+        decoded = recognizer.tokenizer.batch_decode(token_ids.cpu(), skip_special_tokens=True)
+        texts.extend(post_process(text) for text in decoded)
+
+    return texts
+
+
+def compile_models(mpo) -> None:
+    """
+    Compile the text detector and the recognizer's image encoder with
+    torch.compile (default mode: fused kernels, no CUDA graphs).
+
+    CUDA graphs (mode="reduce-overhead") are recorded per thread, and
+    inference never runs on the thread that loads the models (the server
+    runs jobs on its OCR pool, the handler starts a detect thread per
+    call), so graphs would be recorded again in the middle of a request.
+
+    The detector always sees letterboxed 1024x1024 input. The encoder sees
+    fixed-size ViT crops; after a second batch size it is recompiled once
+    with a dynamic batch dimension, which the callers' warmup triggers at
+    startup. The decoder runs a variable number of generate steps and is
+    left in eager mode.
+
+    Args:
+        mpo: Mokuro page OCR pipeline (mocr already wrapped in LineCollector)
+    """
+    # Fall back to eager execution instead of failing if a graph can't compile
+    torch._dynamo.config.suppress_errors = True
+
+    targets = []
+    detector = getattr(mpo, 'text_detector', None)
+    for attr in ('model', 'net'):
+        if isinstance(getattr(detector, attr, None), torch.nn.Module):
+            targets.append((detector, attr, "Text detector"))
+            break
+    recognizer = mpo.mocr.recognizer
+    if hasattr(recognizer, 'model') and hasattr(recognizer.model, 'encoder'):
+        targets.append((recognizer.model, 'encoder', "OCR encoder"))
+
+    for owner, attr, name in targets:
+        try:
+            setattr(owner, attr, torch.compile(getattr(owner, attr)))
+            logger.info(f"✅ {name} compiled")
+        except Exception as e:
+            logger.warning(f"⚠️  Could not compile {name}: {e}")
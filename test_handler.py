@@ -1,49 +1,58 @@
 """
-Local test script for RunPod serverless handler
+Tests for the RunPod serverless handler
 Tests without actually loading models or processing images
 """
 import sys
+import base64
+import asyncio
+import contextlib
+import functools
 import json
-from pathlib import Path
+from io import BytesIO
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
 
 # Mock the heavy dependencies
+@functools.lru_cache(maxsize=256)
+def _fake_block_json(width, height):
+    """Fake text block for a page size, serialized once per size (immutable)"""
+    return json.dumps({
+        "text": f"Test text from {width}x{height} page",
+        "bbox": [100, 100, 200, 150],
+        "vertical": False,
+    })
+
+
+class MockMangaPageOcr:
+    # Static part of every fake result; the page dict and blocks are built
+    # fresh per call since the handler keeps and annotates the results
+    PAGE_TEMPLATE = {"version": "1.0"}
+
+    def __call__(self, img):
+        """Mock page OCR - returns a fake result dict for a decoded image array"""
+        height, width = img.shape[:2]
+
+        return {
+            **self.PAGE_TEMPLATE,
+            "img_width": width,
+            "img_height": height,
+            "blocks": [json.loads(_fake_block_json(width, height))],
+        }
+
+
 class MockMokuroGenerator:
     def __init__(self, device='cpu'):
         self.device = device
+        self.mpocr = None
         print(f"✅ Mock MokuroGenerator initialized on {device}")
 
-    def process_volume(self, volume):
-        """Mock processing - creates fake mokuro.json for each image"""
-        # Find all images in the volume directory
-        volume_dir = volume.path
-        image_files = list(volume_dir.glob("*.jpg")) + list(volume_dir.glob("*.png"))
-
-        # Create a .mokuro.json file for each image
-        for img_file in image_files:
-            mokuro_path = volume_dir / f"{img_file.stem}.mokuro.json"
-
-            fake_data = {
-                "version": "1.0",
-                "title": "Test",
-                "pages": [
-                    {
-                        "index": 0,
-                        "img_path": img_file.name,
-                        "blocks": [
-                            {
-                                "text": f"Test text from {img_file.name}",
-                                "bbox": [100, 100, 200, 150],
-                                "vertical": False
-                            }
-                        ]
-                    }
-                ]
-            }
-
-            with open(mokuro_path, 'w') as f:
-                json.dump(fake_data, f)
-
-        print(f"✅ Mock processed volume → {len(image_files)} pages")
+    def init_models(self):
+        self.mpocr = MockMangaPageOcr()
+
 
 # Mock torch
 class MockCUDA:
@@ -51,105 +60,186 @@ class MockCUDA:
     def is_available():
         return False
 
+
 class MockTorch:
     cuda = MockCUDA()
+
     @staticmethod
     def get_device_name(x):
         return "Mock GPU"
 
-sys.modules['torch'] = MockTorch()
-sys.modules['mokuro'] = type('obj', (object,), {'MokuroGenerator': MockMokuroGenerator})()
-class MockVolume:
-    def __init__(self, path):
-        # Volume wraps the path that contains images
-        self.path = path  # Don't add /volume subdirectory
-        self.path_ocr_cache = path / '_ocr'
-        self.stem = path.stem
-
-sys.modules['mokuro.volume'] = type('obj', (object,), {'Volume': MockVolume})()
-sys.modules['runpod'] = type('obj', (object,), {
-    'serverless': type('obj', (object,), {
-        'start': lambda x: print("✅ Would start RunPod serverless worker")
-    })()
-})()
-
-# Now import handler
-from handler import handler
+    @staticmethod
+    def no_grad():
+        return contextlib.nullcontext()
+
+    @staticmethod
+    def inference_mode():
+        return contextlib.nullcontext()
+
+
+class MockMokuro:
+    MokuroGenerator = MockMokuroGenerator
+
+
+class MockServerless:
+    @staticmethod
+    def start(config):
+        print("✅ Would start RunPod serverless worker")
+
+
+class MockRunpod:
+    serverless = MockServerless()
+
+
+# Stand-ins for the heavy dependencies, injected only while tests run
+MOCK_MODULES = {
+    'torch': MockTorch(),
+    'mokuro': MockMokuro(),
+    'runpod': MockRunpod(),
+}
+
+
+@pytest.fixture(autouse=True)
+def mock_modules(monkeypatch):
+    """Inject the mocks into sys.modules for the duration of each test"""
+    for name, module in MOCK_MODULES.items():
+        monkeypatch.setitem(sys.modules, name, module)
+
+
+# A tiny 1x1 PNG image, base64-encoded (shared by the processing tests)
+_TINY_PNG_B64 = (
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk"
+    "+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=="
+)
+_TINY_PNG_BYTES = base64.b64decode(_TINY_PNG_B64)
+
+
+def _rotated_jpeg() -> bytes:
+    """A 40x20 JPEG stored sideways, with EXIF orientation 6 (rotate 90° CW to view)"""
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    buffer = BytesIO()
+    Image.new('RGB', (40, 20), (255, 255, 255)).save(buffer, format='JPEG', exif=exif)
+    return buffer.getvalue()
+
+
+def test_decode_image_applies_exif_orientation(monkeypatch):
+    """Test that rotated JPEGs skip TurboJPEG (which ignores EXIF orientation)"""
+    import handler
+
+    class IgnoresOrientation:
+        def decode(self, data):
+            flags = cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION
+            return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+
+    monkeypatch.setattr(handler, 'turbo_jpeg', IgnoresOrientation())
+
+    assert handler.decode_image(_rotated_jpeg()).shape[:2] == (40, 20)
+
+
+def test_mock_page_results_are_independent():
+    """Test that annotating one mock page result doesn't leak into the next"""
+    page = np.zeros((20, 40, 3), dtype=np.uint8)
+    first = MockMangaPageOcr()(page)
+    first["blocks"][0]["lines"] = ["changed"]
+
+    assert "lines" not in MockMangaPageOcr()(page)["blocks"][0]
+
 
 def test_health():
     """Test health check endpoint"""
     print("\n🧪 Testing health check...")
+    from handler import handler
     job = {
         'id': 'test-1',
         'input': {'type': 'health'}
     }
 
-    result = handler(job)
+    result = asyncio.run(handler(job))
     print(f"✅ Health check result: {result}")
     assert result['status'] == 'healthy'
     print("✅ Health check PASSED\n")
 
+
 def test_process_single():
     """Test single page processing"""
     print("🧪 Testing process_single...")
-    import base64
-
-    # Create a tiny 1x1 PNG image
-    tiny_png = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=="
-
+    from handler import handler
     job = {
         'id': 'test-2',
         'input': {
             'type': 'process_single',
-            'image': tiny_png,
+            'image_bytes': _TINY_PNG_BYTES,
             'page_index': 0
         }
     }
 
-    result = handler(job)
+    result = asyncio.run(handler(job))
     print(f"✅ Process single result: {result}")
     assert result['status'] == 'success'
     assert 'result' in result
     print("✅ Process single PASSED\n")
 
+
+def test_process_single_base64():
+    """Test single page processing with a base64 data URL"""
+    print("🧪 Testing process_single (base64)...")
+    from handler import handler
+    job = {
+        'id': 'test-2b',
+        'input': {
+            'type': 'process_single',
+            'image': f"data:image/png;base64,{_TINY_PNG_B64}",
+            'page_index': 0
+        }
+    }
+
+    result = asyncio.run(handler(job))
+    assert result['status'] == 'success'
+    assert result['result']['text_blocks']
+    print("✅ Process single (base64) PASSED\n")
+
+
 def test_process_batch():
     """Test batch processing"""
     print("🧪 Testing process_batch...")
-    tiny_png = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=="
-
+    from handler import handler
     job = {
         'id': 'test-3',
         'input': {
             'type': 'process_batch',
             'title': 'Test Batch',
-            'images': [tiny_png, tiny_png]
+            'images_bytes': [_TINY_PNG_BYTES] * 2
         }
     }
 
-    result = handler(job)
+    result = asyncio.run(handler(job))
     print(f"✅ Process batch result: {result}")
     assert result['status'] == 'success'
     assert 'pages' in result
     assert len(result['pages']) == 2
     print("✅ Process batch PASSED\n")
 
-if __name__ == '__main__':
-    print("=" * 60)
-    print("Testing RunPod Serverless Handler Locally")
-    print("=" * 60)
-
-    try:
-        test_health()
-        test_process_single()
-        test_process_batch()
-
-        print("=" * 60)
-        print("✅ ALL TESTS PASSED!")
-        print("=" * 60)
-        print("\n✅ Handler is working correctly - safe to deploy")
-
-    except Exception as e:
-        print(f"\n❌ TEST FAILED: {e}")
-        import traceback
-        traceback.print_exc()
-        sys.exit(1)
+
+def test_process_batch_base64():
+    """Test batch processing with base64 images (plain, data URL, line-wrapped)"""
+    print("🧪 Testing process_batch (base64)...")
+    from handler import handler
+    job = {
+        'id': 'test-3b',
+        'input': {
+            'type': 'process_batch',
+            'title': 'Test Batch',
+            'images': [
+                _TINY_PNG_B64,
+                f"data:image/png;charset=utf-8;base64,{_TINY_PNG_B64}",
+                "\n".join(_TINY_PNG_B64[i:i + 76] for i in range(0, len(_TINY_PNG_B64), 76)),
+            ]
+        }
+    }
+
+    result = asyncio.run(handler(job))
+    assert result['status'] == 'success'
+    assert len(result['pages']) == 3
+    assert all(page['text_blocks'] for page in result['pages'])
+    print("✅ Process batch (base64) PASSED\n")